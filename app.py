@@ -1,8 +1,10 @@
 import streamlit as st
 import psycopg2
+import psycopg2.pool
 import pandas as pd
 from datetime import date, timedelta
 from contextlib import contextmanager
+from pathlib import Path
 
 # ============================================================
 #  КОНФИГУРАЦИЯ
@@ -14,59 +16,15 @@ st.set_page_config(
     initial_sidebar_state="expanded",
 )
 
-# Кастомные стили
-st.markdown("""
-<style>
-    /* Основной фон и шрифт */
-    .main { background-color: #f8f9fb; }
-    
-    /* Карточки метрик */
-    [data-testid="stMetric"] {
-        background: white;
-        border-radius: 12px;
-        padding: 16px 20px;
-        box-shadow: 0 1px 4px rgba(0,0,0,0.08);
-    }
-    [data-testid="stMetric"] * {
-        color: #1a1a2e !important;
-    }
-    [data-testid="stMetricValue"] {
-        color: #1a1a2e !important;
-        font-weight: 700;
-    }
-    [data-testid="stMetricLabel"] {
-        color: #4a5568 !important;
-    }
-    
-    /* Заголовок страницы */
-    .page-header {
-        background: linear-gradient(135deg, #1a1a2e 0%, #16213e 50%, #0f3460 100%);
-        color: white;
-        padding: 28px 32px;
-        border-radius: 16px;
-        margin-bottom: 24px;
-    }
-    .page-header h1 { color: white; margin: 0; font-size: 2rem; }
-    .page-header p  { color: #a0aec0; margin: 4px 0 0; font-size: 0.95rem; }
+# Кастомные стили: файл читается один раз на процесс сервера,
+# а на каждом перезапуске скрипта в страницу уходит готовая строка
+@st.cache_resource(show_spinner=False)
+def _css() -> str:
+    css = Path(__file__).with_name("style.css").read_text(encoding="utf-8")
+    return f"<style>\n{css}</style>"
 
-    /* Бейдж статуса */
-    .badge-free     { background:#d4f4dd; color:#1a7f37; padding:3px 10px; border-radius:20px; font-size:0.8rem; font-weight:600; }
-    .badge-occupied { background:#fde8e8; color:#c0392b; padding:3px 10px; border-radius:20px; font-size:0.8rem; font-weight:600; }
 
-    /* Кнопки */
-    .stButton>button {
-        border-radius: 8px;
-        font-weight: 600;
-    }
-    div[data-testid="stSidebar"] {
-        background: #1a1a2e;
-    }
-    div[data-testid="stSidebar"] > div > div > div * { color: #e2e8f0 !important; }
-    div[data-testid="stSidebar"] .stSelectbox label { color: #a0aec0 !important; }
-    /* Не даём сайдбару перекрывать основной контент */
-    section.main * { color: inherit; }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(_css(), unsafe_allow_html=True)
 
 DB_CONFIG = dict(
     dbname="hotel_db",
@@ -79,36 +37,95 @@ DB_CONFIG = dict(
 # ============================================================
 #  ПОДКЛЮЧЕНИЕ К БД
 # ============================================================
+# Фиксированный пул: minconn == maxconn, putconn не закрывает возвращённые соединения
+POOL_SIZE = 8
+
+
+@st.cache_resource
+def get_pool() -> psycopg2.pool.ThreadedConnectionPool:
+    """Один пул соединений на процесс сервера (общий для всех сессий)."""
+    return psycopg2.pool.ThreadedConnectionPool(POOL_SIZE, POOL_SIZE, **DB_CONFIG)
+
+
 @contextmanager
 def get_db():
-    """Контекстный менеджер: соединение гарантированно закрывается."""
-    conn = psycopg2.connect(**DB_CONFIG)
+    """Соединение из пула; если пул исчерпан — отдельное, которое затем закрывается."""
+    pool = get_pool()
+    try:
+        conn = pool.getconn()
+    except psycopg2.pool.PoolError:
+        pool, conn = None, psycopg2.connect(**DB_CONFIG)
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        # Соединение могло оборваться на сервере — rollback тогда лишь скроет исходную ошибку
+        if not conn.closed:
+            conn.rollback()
         raise
     finally:
-        conn.close()
+        if pool is not None:
+            pool.putconn(conn)
+        else:
+            conn.close()
+
+
+# Колонки статусов с парой-тройкой значений: храним как category (int-коды вместо строк)
+CATEGORY_COLUMNS = ("status", "статус", "статус_брони", "действие")
+
+
+def _catify(df: pd.DataFrame) -> pd.DataFrame:
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_query(sql: str, params=None) -> pd.DataFrame:
+    """Кэш результатов SELECT: ключ — текст запроса + параметры.
+    st.cache_data и так отдаёт каждому вызову свою копию DataFrame."""
+    with get_db() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        cols = [d[0] for d in cur.description]
+        # coerce_float: NUMERIC (Decimal) -> float64, как раньше в pd.read_sql
+        return _catify(pd.DataFrame.from_records(cur.fetchall(), columns=cols, coerce_float=True))
 
 
 def run_query(sql: str, params=None) -> pd.DataFrame:
-    with get_db() as conn:
-        return pd.read_sql(sql, conn, params=params)
+    return _cached_query(sql, params)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _cached_scalar_row(sql: str, params=None) -> tuple:
+    with get_db() as conn, conn.cursor() as cur:
+        cur.execute(sql, params)
+        return cur.fetchone()
+
+
+def run_scalar_row(sql: str, params=None) -> tuple:
+    """Одна строка скаляров (метрики, счётчики) — без построения DataFrame."""
+    return _cached_scalar_row(sql, params)
 
 
 def run_procedure(sql: str, params=None):
-    with get_db() as conn:
-        cur = conn.cursor()
+    with get_db() as conn, conn.cursor() as cur:
         cur.execute(sql, params)
+    # Данные изменились — сбрасываем закэшированные выборки
+    st.cache_data.clear()
 
 # ============================================================
-#  ХЕЛПЕРЫ
+#  ОБЩИЕ ВЫБОРКИ
 # ============================================================
-def status_badge(status: str) -> str:
-    cls = "badge-free" if status == "Свободен" else "badge-occupied"
-    return f'<span class="{cls}">{status}</span>'
+# Один и тот же текст запроса на разных страницах — одна запись в кэше run_query
+def load_guests() -> pd.DataFrame:
+    return run_query("SELECT guest_id, full_name, passport, phone FROM guests ORDER BY full_name")
+
+
+def load_rooms() -> pd.DataFrame:
+    return run_query(
+        "SELECT room_id, room_number, type_name, price_per_night, status, free_from FROM room_status_view"
+    )
 
 # ============================================================
 #  САЙДБАР
@@ -132,7 +149,8 @@ with st.sidebar:
 # ============================================================
 #  ДАШБОРД
 # ============================================================
-if choice == "dashboard":
+@st.fragment
+def page_dashboard():
     st.markdown("""
     <div class="page-header">
         <h1>🏨 Панель управления</h1>
@@ -141,14 +159,14 @@ if choice == "dashboard":
     """, unsafe_allow_html=True)
 
     # --- Метрики ---
-    rooms_df    = run_query("SELECT status FROM room_status_view")
-    bookings_df = run_query("SELECT status, total_cost FROM bookings")
-
-    total_rooms    = len(rooms_df)
-    occupied_rooms = (rooms_df["status"] == "Занят").sum()
-    free_rooms     = total_rooms - occupied_rooms
-    active_bookings = (bookings_df["status"] == "active").sum()
-    revenue = bookings_df.loc[bookings_df["status"] == "active", "total_cost"].sum()
+    total_rooms, occupied_rooms, active_bookings, revenue = run_scalar_row("""
+        SELECT
+            (SELECT COUNT(*) FROM room_status_view)                          AS total,
+            (SELECT COUNT(*) FROM room_status_view WHERE status = 'Занят')   AS occupied,
+            (SELECT COUNT(*) FROM bookings WHERE status = 'active')          AS active_b,
+            COALESCE((SELECT SUM(total_cost) FROM bookings WHERE status = 'active'), 0) AS revenue
+    """)
+    free_rooms = total_rooms - occupied_rooms
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("🛏️ Всего номеров",     total_rooms)
@@ -163,32 +181,27 @@ if choice == "dashboard":
     # График занятости
     with col1:
         st.subheader("Занятость номеров")
-        occ_data = pd.DataFrame({
-            "Статус": ["Свободен", "Занят"],
-            "Кол-во": [free_rooms, occupied_rooms]
-        })
-        st.bar_chart(occ_data.set_index("Статус"), color=["#4CAF50"])
+        st.bar_chart(
+            {"Статус": ["Свободен", "Занят"], "Кол-во": [free_rooms, occupied_rooms]},
+            x="Статус", y="Кол-во", color=["#4CAF50"],
+        )
 
     # Выручка по типам номеров
     with col2:
         st.subheader("Выручка по типам номеров")
-        rev_df = run_query("""
-            SELECT rt.type_name, SUM(b.total_cost) AS выручка
-            FROM bookings b
-            JOIN rooms r ON b.room_id = r.room_id
-            JOIN room_types rt ON r.type_id = rt.type_id
-            WHERE b.status = 'active'
-            GROUP BY rt.type_name
-        """)
+        # Агрегат заранее посчитан в revenue_by_type_mv (обновляется триггером на bookings)
+        rev_df = run_query("SELECT type_name, revenue AS выручка FROM revenue_by_type_mv")
         if not rev_df.empty:
             st.bar_chart(rev_df.set_index("type_name"))
         else:
             st.info("Нет активных бронирований")
 
+
 # ============================================================
 #  ОБЗОР НОМЕРОВ
 # ============================================================
-elif choice == "rooms":
+@st.fragment
+def page_rooms():
     st.markdown("""
     <div class="page-header">
         <h1>🛏️ Номерной фонд</h1>
@@ -196,16 +209,15 @@ elif choice == "rooms":
     </div>
     """, unsafe_allow_html=True)
 
-    df = run_query("SELECT room_number, type_name, price_per_night, status, free_from FROM room_status_view")
+    df = load_rooms()
 
     # Фильтр
     filter_status = st.radio("Фильтр по статусу", ["Все", "Свободен", "Занят"], horizontal=True)
     if filter_status != "Все":
         df = df[df["status"] == filter_status]
 
-    # Таблица с бейджами
-    df["status_html"] = df["status"].apply(status_badge)
-    df["price_per_night"] = df["price_per_night"].apply(lambda x: f"{x:,.0f} ₽")
+    # Форматирование цены: list comprehension по массиву дешевле, чем Series.apply
+    df["price_per_night"] = [f"{p:,.0f} ₽" for p in df["price_per_night"].to_numpy()]
     df["free_from"] = df["free_from"].fillna("—")
 
     st.dataframe(
@@ -220,10 +232,12 @@ elif choice == "rooms":
         hide_index=True,
     )
 
+
 # ============================================================
 #  БРОНИРОВАНИЕ
 # ============================================================
-elif choice == "book":
+@st.fragment
+def page_book():
     st.markdown("""
     <div class="page-header">
         <h1>📅 Новое бронирование</h1>
@@ -231,8 +245,13 @@ elif choice == "book":
     </div>
     """, unsafe_allow_html=True)
 
-    rooms_df  = run_query("SELECT room_id, room_number, type_name, price_per_night, status FROM room_status_view")
-    guests_df = run_query("SELECT guest_id, full_name FROM guests ORDER BY full_name")
+    rooms_df  = load_rooms()
+    guests_df = load_guests()
+
+    # Словари для поиска за O(1) вместо фильтрации DataFrame на каждую опцию
+    room_type_map = dict(zip(rooms_df["room_number"].to_numpy(), rooms_df["type_name"].to_numpy()))
+    room_row_map  = rooms_df.set_index("room_number")
+    guest_id_map  = dict(zip(guests_df["full_name"], guests_df["guest_id"]))
 
     col1, col2 = st.columns([1, 1])
 
@@ -241,9 +260,9 @@ elif choice == "book":
         selected_room_no = st.selectbox(
             "Номер",
             rooms_df["room_number"].tolist(),
-            format_func=lambda n: f"№{n} — {rooms_df[rooms_df['room_number']==n]['type_name'].values[0]}"
+            format_func=lambda n: f"№{n} — {room_type_map[n]}"
         )
-        room_row = rooms_df[rooms_df["room_number"] == selected_room_no].iloc[0]
+        room_row = room_row_map.loc[selected_room_no]
         r_id = int(room_row["room_id"])
 
         # Инфо о номере
@@ -262,8 +281,8 @@ elif choice == "book":
         if busy_df.empty:
             st.success("Номер свободен на ближайшее время")
         else:
-            for _, row in busy_df.iterrows():
-                st.warning(f"🔴 {row['check_in']} → {row['check_out']}")
+            for ci, co in zip(busy_df["check_in"].to_numpy(), busy_df["check_out"].to_numpy()):
+                st.warning(f"🔴 {ci} → {co}")
 
     with col2:
         st.subheader("Данные брони")
@@ -285,17 +304,19 @@ elif choice == "book":
                     st.error("Дата выезда должна быть позже даты заезда!")
                 else:
                     try:
-                        g_id = int(guests_df[guests_df["full_name"] == selected_guest]["guest_id"].values[0])
+                        g_id = int(guest_id_map[selected_guest])
                         run_procedure("CALL make_booking(%s, %s, %s, %s)", (g_id, r_id, date_in, date_out))
                         st.success("🎉 Бронирование успешно оформлено!")
                         st.rerun()
                     except Exception as e:
                         st.error(f"Ошибка: {e}")
 
+
 # ============================================================
 #  РЕГИСТРАЦИЯ ГОСТЯ
 # ============================================================
-elif choice == "guest":
+@st.fragment
+def page_guest():
     st.markdown("""
     <div class="page-header">
         <h1>👤 Регистрация гостя</h1>
@@ -327,13 +348,19 @@ elif choice == "guest":
 
     with col2:
         st.subheader("Зарегистрированные гости")
-        guests_df = run_query("SELECT full_name AS ФИО, passport AS Паспорт, phone AS Телефон FROM guests ORDER BY full_name")
+        guests_df = load_guests()[["full_name", "passport", "phone"]].rename(columns={
+            "full_name": "ФИО",
+            "passport":  "Паспорт",
+            "phone":     "Телефон",
+        })
         st.dataframe(guests_df, use_container_width=True, hide_index=True)
 
+
 # ============================================================
 #  ВСЕ БРОНИРОВАНИЯ + ОТМЕНА
 # ============================================================
-elif choice == "bookings":
+@st.fragment
+def page_bookings():
     st.markdown("""
     <div class="page-header">
         <h1>📋 Активные бронирования</h1>
@@ -341,33 +368,47 @@ elif choice == "bookings":
     </div>
     """, unsafe_allow_html=True)
 
-    df = run_query("""
+    # Фильтр по статусу — в SQL, чтобы LIMIT считался внутри выбранного статуса
+    status_filter = st.radio("Статус", ["active", "cancelled", "Все"], horizontal=True)
+
+    # По умолчанию — только последние брони; полный список по запросу
+    recent_limit = 200
+    show_all = st.checkbox(f"Показать все (по умолчанию последние {recent_limit})")
+
+    bookings_sql = """
         SELECT b.booking_id, g.full_name AS гость, r.room_number AS номер,
                b.check_in AS заезд, b.check_out AS выезд,
                b.total_cost AS стоимость, b.status AS статус
         FROM bookings b
         JOIN guests g ON b.guest_id = g.guest_id
         JOIN rooms  r ON b.room_id  = r.room_id
-        ORDER BY b.check_in DESC
-    """)
-
-    # Фильтр по статусу
-    status_filter = st.radio("Статус", ["active", "cancelled", "Все"], horizontal=True)
-    view_df = df if status_filter == "Все" else df[df["статус"] == status_filter]
+    """
+    sql, params = bookings_sql, []
+    if status_filter != "Все":
+        sql += " WHERE b.status = %s"
+        params.append(status_filter)
+    sql += " ORDER BY b.check_in DESC"
+    if not show_all:
+        sql += " LIMIT %s"
+        params.append(recent_limit)
+    view_df = run_query(sql, params=tuple(params) or None)
 
     st.dataframe(view_df, use_container_width=True, hide_index=True)
+    if not show_all and len(view_df) == recent_limit:
+        st.caption(f"Показаны последние {recent_limit} броней — отметьте «Показать все», чтобы увидеть остальные.")
 
-    # Отмена бронирования
+    # Отмена бронирования: список активных броней без ограничения
     st.markdown("---")
     st.subheader("❌ Отмена бронирования")
-    active_df = df[df["статус"] == "active"]
+    active_df = run_query(bookings_sql + " WHERE b.status = 'active' ORDER BY b.check_in DESC")
 
     if active_df.empty:
         st.info("Нет активных бронирований для отмены.")
     else:
+        rows = active_df[["booking_id", "гость", "номер", "заезд", "выезд"]].to_numpy()
         booking_options = {
-            f"#{row['booking_id']} — {row['гость']}, №{row['номер']} ({row['заезд']} → {row['выезд']})": row["booking_id"]
-            for _, row in active_df.iterrows()
+            f"#{b} — {g}, №{n} ({ci} → {co})": int(b)
+            for b, g, n, ci, co in rows
         }
         selected_label = st.selectbox("Выберите бронь для отмены", list(booking_options.keys()))
         if st.button("Отменить бронирование", type="primary"):
@@ -378,10 +419,12 @@ elif choice == "bookings":
             except Exception as e:
                 st.error(f"Ошибка: {e}")
 
+
 # ============================================================
 #  ИСТОРИЯ БРОНИРОВАНИЙ
 # ============================================================
-elif choice == "history":
+@st.fragment
+def page_history():
     st.markdown("""
     <div class="page-header">
         <h1>🕓 История бронирований</h1>
@@ -389,26 +432,85 @@ elif choice == "history":
     </div>
     """, unsafe_allow_html=True)
 
-    df = run_query("""
+    # Поиск по гостю — фильтруем в БД (ILIKE + триграммный индекс на guests.full_name)
+    search = st.text_input("🔍 Поиск по имени гостя")
+
+    # Постраничный вывод (keyset): стек курсоров (changed_at, history_id) начала страниц
+    page_size = 100
+    if st.session_state.get("hist_search") != search:
+        st.session_state["hist_search"]  = search
+        st.session_state["hist_cursors"] = [None]
+    cursors = st.session_state["hist_cursors"]
+    cursor  = cursors[-1]
+
+    conditions, params = [], []
+    if search:
+        conditions.append("guest_name ILIKE %s")
+        # Экранируем спецсимволы LIKE, чтобы "_" и "%" искались буквально
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params.append(f"%{escaped}%")
+    where = (" WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    page_conditions, page_params = list(conditions), list(params)
+    if cursor is not None:
+        page_conditions.append("(changed_at, history_id) < (%s, %s)")
+        page_params.extend(cursor)
+    page_where = (" WHERE " + " AND ".join(page_conditions)) if page_conditions else ""
+
+    df = run_query(f"""
         SELECT history_id AS id, booking_id, guest_name AS гость,
                room_number AS номер, check_in AS заезд, check_out AS выезд,
                total_cost AS стоимость, booking_status AS статус_брони,
                action AS действие, changed_at AS время
-        FROM booking_history_view
-    """)
+        FROM booking_history_view{page_where}
+        ORDER BY changed_at DESC, history_id DESC
+        LIMIT %s
+    """, params=(*page_params, page_size + 1))
 
-    # Поиск по гостю
-    search = st.text_input("🔍 Поиск по имени гостя")
-    if search:
-        df = df[df["гость"].str.contains(search, case=False, na=False)]
+    has_next = len(df) > page_size
+    df = df.iloc[:page_size]
 
     st.dataframe(df, use_container_width=True, hide_index=True)
 
-    # Сводная статистика
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if st.button("← Назад", disabled=len(cursors) == 1, use_container_width=True):
+            cursors.pop()
+            st.rerun(scope="fragment")
+    with page_col:
+        st.caption(f"Страница {len(cursors)}")
+    with next_col:
+        if st.button("Вперёд →", disabled=not has_next, use_container_width=True):
+            last = df.iloc[-1]
+            cursors.append((last["время"], int(last["id"])))
+            st.rerun(scope="fragment")
+
+    # Сводная статистика по всей истории (с учётом поиска), а не по странице
+    total_actions, cancelled = run_scalar_row(f"""
+        SELECT COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE action = 'cancelled') AS cancelled
+        FROM booking_history_view{where}
+    """, params=tuple(params) or None)
+
     st.markdown("---")
     col1, col2 = st.columns(2)
     with col1:
-        st.metric("Всего действий в истории", len(df))
+        st.metric("Всего действий в истории", total_actions)
     with col2:
-        if "действие" in df.columns:
-            st.metric("Отменено бронирований", (df["действие"] == "cancelled").sum())
\ No newline at end of file
+        st.metric("Отменено бронирований", cancelled)
+
+
+# ============================================================
+#  РОУТИНГ
+# ============================================================
+# Каждая страница — фрагмент: виджеты внутри перезапускают только её,
+# без сайдбара и запросов других разделов
+PAGES = {
+    "dashboard": page_dashboard,
+    "rooms":     page_rooms,
+    "book":      page_book,
+    "guest":     page_guest,
+    "bookings":  page_bookings,
+    "history":   page_history,
+}
+PAGES[choice]()